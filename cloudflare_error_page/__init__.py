@@ -1,6 +1,7 @@
 import html
 import secrets
 import sys
+from collections.abc import Callable, Iterator, Mapping
 from datetime import datetime, timezone
 from typing import Any, TypedDict, Literal
 
@@ -14,6 +15,8 @@ else:
 
 from jinja2 import Environment, PackageLoader, Template, select_autoescape
 
+from .profiler import RenderProfiler
+
 jinja_env = Environment(
     loader=PackageLoader(__name__),
     autoescape=select_autoescape(),
@@ -70,45 +73,362 @@ class ErrorPageParams(TypedDict):
     creator_info: NotRequired[CreatorInfo]
 
 
+_STATUS_ITEM_KEYS = ('browser_status', 'cloudflare_status', 'host_status')
+_STATUS_ITEM_FIELDS = ('status', 'location', 'name', 'status_text', 'status_text_color')
+_STATUS_VALUES = ('ok', 'error')
+_ERROR_SOURCE_VALUES = ('browser', 'cloudflare', 'host')
+_LINK_ITEM_FIELDS = {
+    'more_information': ('hidden', 'text', 'link', 'for'),
+    'perf_sec_by': ('text', 'link'),
+    'creator_info': ('hidden', 'link', 'text'),
+}
+_TEXT_FIELDS = ('html_title', 'title', 'time', 'what_happened', 'what_can_i_do', 'ray_id', 'client_ip')
+_HTML_FIELDS = ('what_happened', 'what_can_i_do')
+
+
+def _freeze_value(value: Any) -> Any:
+    if isinstance(value, FrozenMapping):
+        return value
+    if isinstance(value, Mapping):
+        return FrozenMapping(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze_value(v) for v in value)
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f'Unsupported parameter value type: {type(value).__name__}')
+
+
+# Key -> position maps shared by all mappings with the same keys, like the key sharing of instance dicts
+_shared_indexes: dict[tuple[str, ...], dict[str, int]] = {}
+_MAX_SHARED_INDEXES = 1024
+
+
+def _get_index(keys: tuple[str, ...]) -> dict[str, int]:
+    index = _shared_indexes.get(keys)
+    if index is None:
+        index = {key: i for i, key in enumerate(keys)}
+        # Bounded, as keys of user provided parameters are arbitrary
+        if len(_shared_indexes) < _MAX_SHARED_INDEXES:
+            _shared_indexes[keys] = index
+    return index
+
+
+class FrozenMapping(Mapping[str, Any]):
+    """Immutable and hashable mapping. Nested mappings and lists are frozen recursively.
+
+    Only the values are stored per object, in a tuple. The key index is shared between mappings with the same keys.
+    """
+
+    __slots__ = ('_index', '_values', '_hash')
+
+    _index: dict[str, int]
+    _values: tuple[Any, ...]
+    _hash: int
+
+    def __init__(self, data: Mapping[str, Any] | None = None):
+        frozen = {key: _freeze_value(value) for key, value in (data or {}).items()}
+        self._init(frozen)
+
+    def _init(self, data: dict[str, Any]):
+        object.__setattr__(self, '_index', _get_index(tuple(data)))
+        object.__setattr__(self, '_values', tuple(data.values()))
+        object.__setattr__(self, '_hash', hash(frozenset(data.items())))
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name: str):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __getitem__(self, key: str) -> Any:
+        return self._values[self._index[key]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._index
+
+    def get(self, key: str, default: Any = None) -> Any:
+        i = self._index.get(key)
+        return default if i is None else self._values[i]
+
+    def _items(self) -> dict[str, Any]:
+        return dict(zip(self._index, self._values))
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, FrozenMapping):
+            return self._hash == other._hash and self._items() == other._items()
+        if isinstance(other, Mapping):
+            return self._items() == dict(other.items())
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self._items()!r})'
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert back to plain (mutable) dicts and lists, e.g. for JSON serialization."""
+
+        def thaw(value: Any) -> Any:
+            if isinstance(value, FrozenMapping):
+                return {k: thaw(v) for k, v in zip(value._index, value._values)}
+            if isinstance(value, tuple):
+                return [thaw(v) for v in value]
+            return value
+
+        return thaw(self)
+
+
+def _check_str(key: str, value: Any) -> str:
+    if not isinstance(value, str):
+        raise TypeError(f'"{key}" must be a string, got {type(value).__name__}')
+    return value
+
+
+def _normalize_item_field(
+    key: str,
+    field: str,
+    value: Any,
+    fields: tuple[str, ...],
+    link_sanitizer: Callable[[str], str] | None,
+) -> Any:
+    if field not in fields:
+        return _freeze_value(value)
+    if field == 'hidden':
+        if not isinstance(value, bool):
+            raise TypeError(f'"{key}.hidden" must be a bool, got {type(value).__name__}')
+        return value
+    if field == 'status':
+        if value and value not in _STATUS_VALUES:
+            raise ValueError(f'"{key}.status" must be one of {_STATUS_VALUES}, got {value!r}')
+        return value
+    if field == 'link':
+        value = _check_str(f'{key}.link', value)
+        return link_sanitizer(value) if link_sanitizer and value else value
+    return _check_str(f'{key}.{field}', value)
+
+
+def _normalize_item(
+    key: str,
+    item: Any,
+    fields: tuple[str, ...],
+    link_sanitizer: Callable[[str], str] | None,
+    strict: bool,
+) -> FrozenMapping:
+    if not isinstance(item, Mapping):
+        raise TypeError(f'"{key}" must be a mapping, got {type(item).__name__}')
+    result = {}
+    for field, value in item.items():
+        if value is None:
+            continue
+        if field == 'for_text':
+            field = 'for'  # renamed to avoid Python keyword conflict
+        try:
+            result[field] = _normalize_item_field(key, field, value, fields, link_sanitizer)
+        except (TypeError, ValueError):
+            if strict:
+                raise
+    return FrozenMapping(result)
+
+
+class FrozenErrorPageParams(FrozenMapping):
+    """Validated, immutable and hashable error page parameters.
+
+    All normalization done by ``render`` (``for_text`` remapping, HTML escaping) and optional link sanitization is
+    performed once at construction, so the object can be reused across many ``render`` calls and serve as a cache key.
+
+    ``time`` and ``ray_id`` are left empty if not given; ``render`` fills them per call.
+
+    :param params: Parameters to freeze. Refer to ``ErrorPageParams`` for the accepted keys.
+        If it's a ``FrozenErrorPageParams``, its values are copied as they are, without sanitizing links again.
+    :param allow_html: Allow raw HTML content in ``what_happened`` and ``what_can_i_do``. They are escaped if False.
+        Defaults to the setting of ``params`` if it's a ``FrozenErrorPageParams``, True otherwise.
+    :param link_sanitizer: Optional function applied to ``more_information.link`` and ``perf_sec_by.link``, also by
+        ``replace``. Defaults to the sanitizer of ``params`` if it's a ``FrozenErrorPageParams``.
+    :param strict: Raise on invalid parameters. If False, invalid parameters are dropped instead, e.g. for data which
+        was stored before being validated.
+    :raises TypeError: If a parameter has the wrong type.
+    :raises ValueError: If a parameter has an invalid value.
+    """
+
+    __slots__ = ('allow_html', 'link_sanitizer')
+
+    allow_html: bool
+    link_sanitizer: Callable[[str], str] | None
+
+    def __init__(
+        self,
+        params: ErrorPageParams | Mapping[str, Any] | None = None,
+        allow_html: bool | None = None,
+        link_sanitizer: Callable[[str], str] | None = None,
+        strict: bool = True,
+    ):
+        if params is not None and not isinstance(params, Mapping):
+            raise TypeError(f'params must be a mapping, got {type(params).__name__}')
+        if isinstance(params, FrozenErrorPageParams):
+            # Already normalized, only the escaping of HTML fields may change. Links are not sanitized again.
+            if allow_html is None:
+                allow_html = params.allow_html
+            if link_sanitizer is None:
+                link_sanitizer = params.link_sanitizer
+            data = params._items()
+            if allow_html != params.allow_html:
+                convert = html.unescape if allow_html else html.escape
+                for key in _HTML_FIELDS:
+                    if key in data:
+                        data[key] = convert(data[key])
+            object.__setattr__(self, 'allow_html', allow_html)
+            object.__setattr__(self, 'link_sanitizer', link_sanitizer)
+            self._init(data)
+            return
+        if allow_html is None:
+            allow_html = True
+        object.__setattr__(self, 'allow_html', allow_html)
+        object.__setattr__(self, 'link_sanitizer', link_sanitizer)
+        self._init(self._normalize(params or {}, strict))
+
+    def _normalize_param(self, key: str, value: Any, strict: bool) -> Any:
+        if key in _STATUS_ITEM_KEYS:
+            return _normalize_item(key, value, _STATUS_ITEM_FIELDS, None, strict)
+        if key in _LINK_ITEM_FIELDS:
+            return _normalize_item(key, value, _LINK_ITEM_FIELDS[key], self.link_sanitizer, strict)
+        if key == 'error_code':
+            if isinstance(value, bool) or not isinstance(value, (str, int)):
+                raise TypeError(f'"error_code" must be a string or int, got {type(value).__name__}')
+            return str(value)
+        if key == 'error_source':
+            if value and value not in _ERROR_SOURCE_VALUES:
+                raise ValueError(f'"error_source" must be one of {_ERROR_SOURCE_VALUES}, got {value!r}')
+            return value
+        if key in _TEXT_FIELDS:
+            value = _check_str(key, value)
+            if key in _HTML_FIELDS and not self.allow_html:
+                value = html.escape(value)
+            return value
+        return _freeze_value(value)
+
+    def _normalize(self, params: Mapping[str, Any], strict: bool = True) -> dict[str, Any]:
+        result = {}
+        for key, value in params.items():
+            if value is None:
+                continue
+            try:
+                result[key] = self._normalize_param(key, value, strict)
+            except (TypeError, ValueError):
+                if strict:
+                    raise
+        return result
+
+    def replace(self, **changes: Any) -> 'FrozenErrorPageParams':
+        """Return a copy with some parameters replaced. Only the changed parameters are normalized again.
+
+        A value of None removes the parameter.
+        """
+        data = self._items()
+        for key, value in self._normalize(changes).items():
+            data[key] = value
+        for key, value in changes.items():
+            if value is None:
+                data.pop(key, None)
+        result = object.__new__(type(self))
+        object.__setattr__(result, 'allow_html', self.allow_html)
+        object.__setattr__(result, 'link_sanitizer', self.link_sanitizer)
+        result._init(data)
+        return result
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, FrozenErrorPageParams) and self.allow_html != other.allow_html:
+            return False
+        return super().__eq__(other)
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self._items()!r}, allow_html={self.allow_html!r})'
+
+
 def render(
-    params: ErrorPageParams,
+    params: ErrorPageParams | FrozenErrorPageParams,
     allow_html: bool = True,
     template: Template | None = None,
     *args: Any,
+    profiler: RenderProfiler | None = None,
     **kwargs: Any,
 ) -> str:
     """Render a customized Cloudflare error page.
 
     :param params: Parameters passed to the template. Refer to the project homepage for more information.
+        Either a plain dict, or a ``FrozenErrorPageParams`` which is already normalized.
     :param allow_html: Allow output raw HTML content from parameters. Set to False if you don't trust the source of the params.
     :param template: Jinja template used to render the error page. Default template will be used if ``template`` is None.
         Override this to extend or customize the base template.
     :param args: Additional positional arguments passed to ``Template.render`` function.
+    :param profiler: Profile this render if ``profiler.sample()`` returns True. Templates passed in ``kwargs``
+        (e.g. the parent of an extended template) are profiled as well. If ``template`` was not loaded from a
+        loader, nothing is instrumented and only the whole render is recorded.
     :param kwargs: Additional keyword arguments passed to ``Template.render`` function.
     :return: The rendered error page as a string.
     """
     if not template:
         template = base_template
 
-    params = {**params}
+    if isinstance(params, FrozenErrorPageParams):
+        escape_html = not allow_html and params.allow_html
+        if escape_html or not params.get('time') or not params.get('ray_id'):
+            # Shallow copy only, nested parameters are already frozen
+            params = {**params}
+            if escape_html:
+                for key in _HTML_FIELDS:
+                    if key in params:
+                        params[key] = html.escape(params[key])
+    else:
+        params = {**params}
+
+        more_information = params.get('more_information')
+        if more_information:
+            for_text = more_information.get('for_text')
+            if for_text is not None:
+                more_information['for'] = for_text
 
-    more_information = params.get('more_information')
-    if more_information:
-        for_text = more_information.get('for_text')
-        if for_text is not None:
-            more_information['for'] = for_text
+        if not allow_html:
+            params['what_happened'] = html.escape(params.get('what_happened', ''))
+            params['what_can_i_do'] = html.escape(params.get('what_can_i_do', ''))
 
     if not params.get('time'):
         utc_now = datetime.now(timezone.utc)
         params['time'] = utc_now.strftime('%Y-%m-%d %H:%M:%S UTC')
     if not params.get('ray_id'):
         params['ray_id'] = secrets.token_hex(8)
-    if not allow_html:
-        params['what_happened'] = html.escape(params.get('what_happened', ''))
-        params['what_can_i_do'] = html.escape(params.get('what_can_i_do', ''))
+
+    if profiler is not None and profiler.sample():
+        # Templates which can't be instrumented (e.g. from Environment.from_string) are only timed as a whole. Their
+        # parents can't be instrumented either, as the profiling function is only defined in instrumented templates.
+        if profiler.can_instrument(template):
+            template = profiler.instrument(template)
+            for key, value in kwargs.items():
+                if isinstance(value, Template) and profiler.can_instrument(value):
+                    kwargs[key] = profiler.instrument(value)
+        with profiler.profile(f'render {template.name or "<template>"}') as output:
+            output.append(template.render(params=params, *args, **kwargs))
+        return output[0]
 
     return template.render(params=params, *args, **kwargs)
 
 
 __version__ = '0.2.0'
-__all__ = ['jinja_env', 'base_template', 'render']
+__all__ = [
+    'jinja_env',
+    'base_template',
+    'render',
+    'ErrorPageParams',
+    'FrozenErrorPageParams',
+    'FrozenMapping',
+    'RenderProfiler',
+]
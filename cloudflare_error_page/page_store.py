@@ -0,0 +1,394 @@
+"""Cross-process store of pre-rendered error pages, backed by a memory-mapped file.
+
+Pages are rendered once with placeholders for the per-request values (``time``, ``ray_id``, ``client_ip`` and any
+extra template arguments passed as slots), split into the static content and slot offsets, and written to a shared
+file. Every process mapping the same file reads them without rendering, only filling in the slots.
+
+File layout: a header, a hash index with fixed size entries (open addressing), and an append-only data area. Entries
+are never modified after being written, and each carries its key and a checksum, so readers don't need any lock.
+Writers are serialized with ``flock``. When the file is full, a new file is created and atomically renamed over the
+old one, which is then marked as retired so that other processes switch to the new file on their next access.
+
+This module requires ``fcntl`` and ``mmap``, i.e. a POSIX system.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import re
+import secrets
+import struct
+import threading
+import types
+import weakref
+import zlib
+from collections.abc import Iterable, Mapping
+from datetime import datetime, timezone
+from typing import Any
+
+from jinja2 import Template, meta
+from markupsafe import escape
+
+from . import ErrorPageParams, FrozenErrorPageParams, RenderProfiler, __version__, base_template, render
+
+_MAGIC = b'CFEP'
+_VERSION = 1
+# magic, version, retired, index slots, data size, data used
+_HEADER = struct.Struct('<4sIIIQQ')
+_HEADER_SIZE = 64
+# key digest, data offset, data length, reserved
+_INDEX_ENTRY = struct.Struct('<16sQII')
+# key digest, payload crc32, slot count, static data length
+_PAGE_HEADER = struct.Struct('<16sIII')
+_SLOT = struct.Struct('<IB')
+_MAX_PROBES = 32
+_EMPTY_KEY = bytes(16)
+
+_PARAM_SLOTS = ('time', 'ray_id', 'client_ip')
+_PLACEHOLDER_TOKEN = secrets.token_hex(8)
+_PLACEHOLDER_RE = re.compile(f'\x00{_PLACEHOLDER_TOKEN}:(\\w+)\x00')
+
+
+def _placeholder(name: str) -> str:
+    return f'\x00{_PLACEHOLDER_TOKEN}:{name}\x00'
+
+
+_template_digests: 'weakref.WeakKeyDictionary[Template, str]' = weakref.WeakKeyDictionary()
+
+
+def _update_code_digest(h: 'hashlib._Hash', code: types.CodeType):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_code_digest(h, const)
+        else:
+            h.update(repr(const).encode())
+
+
+def _template_digest(template: Template) -> str:
+    """Digest of the source of ``template`` and of the templates it extends or includes by name.
+
+    Pages in the store are keyed by it, so that they are rendered again when a template changes, e.g. after a
+    package upgrade. Computed once per template object.
+    """
+    digest = _template_digests.get(template)
+    if digest is not None:
+        return digest
+    h = hashlib.blake2b(digest_size=16)
+    env = template.environment
+    if template.name is not None and env.loader is not None:
+        pending = [template.name]
+        seen = set()
+        while pending:
+            name = pending.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            source = env.loader.get_source(env, name)[0]
+            h.update(f'{name}\x00{source}\x00'.encode())
+            pending.extend(n for n in meta.find_referenced_templates(env.parse(source)) if n is not None)
+    else:
+        # The source of templates from Environment.from_string is not kept, use the compiled code instead
+        for func in (template.root_render_func, *template.blocks.values()):
+            _update_code_digest(h, func.__code__)
+    digest = _template_digests[template] = h.hexdigest()
+    return digest
+
+
+class CompiledPage:
+    """A rendered page split into static content and slots for per-request values."""
+
+    __slots__ = ('data', 'slots')
+
+    def __init__(self, data: bytes | memoryview, slots: tuple[tuple[int, str], ...]):
+        #: UTF-8 encoded page without the slots
+        self.data = data
+        #: Byte offsets in ``data`` and names of the slots, in order
+        self.slots = slots
+
+    @classmethod
+    def from_rendered(cls, page: str) -> 'CompiledPage':
+        parts = []
+        slots = []
+        offset = 0
+        pos = 0
+        for match in _PLACEHOLDER_RE.finditer(page):
+            part = page[pos : match.start()].encode()
+            parts.append(part)
+            offset += len(part)
+            slots.append((offset, match.group(1)))
+            pos = match.end()
+        parts.append(page[pos:].encode())
+        return cls(b''.join(parts), tuple(slots))
+
+    def fill(self, values: Mapping[str, Any]) -> bytes:
+        """Return the page with the slots filled with HTML-escaped ``values``."""
+        data = memoryview(self.data)
+        parts = []
+        pos = 0
+        for offset, name in self.slots:
+            parts.append(data[pos:offset])
+            parts.append(str(escape(values.get(name, ''))).encode())
+            pos = offset
+        parts.append(data[pos:])
+        return b''.join(parts)
+
+    def to_bytes(self, key: bytes) -> bytes:
+        slot_names = sorted({name for _, name in self.slots})
+        names = json.dumps(slot_names).encode()
+        slots = b''.join(_SLOT.pack(offset, slot_names.index(name)) for offset, name in self.slots)
+        payload = struct.pack('<I', len(names)) + names + slots + bytes(self.data)
+        return _PAGE_HEADER.pack(key, zlib.crc32(payload), len(self.slots), len(self.data)) + payload
+
+    @classmethod
+    def from_buffer(cls, buffer: memoryview, key: bytes) -> 'CompiledPage | None':
+        """Load a page written by ``to_bytes``. The static content references ``buffer`` without copying it.
+
+        Returns None if the data doesn't belong to ``key`` or is corrupted.
+        """
+        if len(buffer) < _PAGE_HEADER.size:
+            return None
+        page_key, crc, slot_count, data_length = _PAGE_HEADER.unpack_from(buffer)
+        payload = buffer[_PAGE_HEADER.size :]
+        if page_key != key or zlib.crc32(payload) != crc:
+            return None
+        (names_length,) = struct.unpack_from('<I', payload)
+        pos = 4 + names_length
+        slot_names = json.loads(bytes(payload[4:pos]))
+        slots = []
+        for _ in range(slot_count):
+            offset, name_index = _SLOT.unpack_from(payload, pos)
+            slots.append((offset, slot_names[name_index]))
+            pos += _SLOT.size
+        return cls(payload[pos : pos + data_length], tuple(slots))
+
+
+class PageStore:
+    """Pre-rendered error pages shared between processes through a memory-mapped file.
+
+    :param path: Path of the store file. It's created if it doesn't exist. All processes should use the same path.
+    :param size: Size of the store file in bytes.
+    :param index_slots: Number of entries of the hash index. Rounded up to a power of two.
+    """
+
+    def __init__(self, path: str | os.PathLike, size: int = 64 * 1024 * 1024, index_slots: int = 16384):
+        self.path = os.fspath(path)
+        self.index_slots = 1 << max(0, index_slots - 1).bit_length()
+        self.size = max(size, _HEADER_SIZE + self.index_slots * _INDEX_ENTRY.size + 4096)
+        self._lock = threading.Lock()
+        self._file = None
+        self._mmap: mmap.mmap | None = None
+        self._open()
+
+    def _data_offset(self, index_slots: int) -> int:
+        return _HEADER_SIZE + index_slots * _INDEX_ENTRY.size
+
+    def _create_file(self) -> str:
+        tmp_path = f'{self.path}.{os.getpid()}.{secrets.token_hex(4)}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.truncate(self.size)
+            data_size = self.size - self._data_offset(self.index_slots)
+            f.write(_HEADER.pack(_MAGIC, _VERSION, 0, self.index_slots, data_size, 0))
+        return tmp_path
+
+    def _open(self):
+        if not os.path.exists(self.path):
+            tmp_path = self._create_file()
+            try:
+                # Fails if another process created the file first
+                os.link(tmp_path, self.path)
+            except FileExistsError:
+                pass
+            finally:
+                os.unlink(tmp_path)
+        file = open(self.path, 'r+b')
+        try:
+            mm = mmap.mmap(file.fileno(), 0)
+        except:
+            file.close()
+            raise
+        self._file, self._mmap = file, mm
+        magic, version, _, index_slots, data_size, _ = _HEADER.unpack_from(mm)
+        if magic != _MAGIC or version != _VERSION or self._data_offset(index_slots) + data_size > len(mm):
+            with self._locked_file():
+                self._rotate()
+
+    def _remap(self):
+        # The old mapping is not closed, pages returned by get() may still reference it
+        if self._file is not None:
+            self._file.close()
+        self._file = self._mmap = None
+        self._open()
+
+    def _retired(self) -> bool:
+        return _HEADER.unpack_from(self._mmap)[2] != 0
+
+    @contextlib.contextmanager
+    def _locked_file(self):
+        file = self._file
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            # Closing the file (when it's rotated) releases the lock as well
+            if not file.closed:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+    def _rotate(self):
+        """Replace the store file with an empty one and retire the current one. Must hold the file lock."""
+        tmp_path = self._create_file()
+        os.replace(tmp_path, self.path)
+        mm = self._mmap
+        mm[8:12] = struct.pack('<I', 1)  # retired
+        self._file.close()
+        self._file = self._mmap = None
+        self._open()
+
+    def _find(self, mm: mmap.mmap, key: bytes) -> tuple[int, int, int]:
+        """Return (entry position, data offset, data length) of ``key``, or of a free entry with offset -1."""
+        index_slots = _HEADER.unpack_from(mm)[3]
+        start = int.from_bytes(key[:8], 'little') & (index_slots - 1)
+        for i in range(min(_MAX_PROBES, index_slots)):
+            entry_pos = _HEADER_SIZE + ((start + i) & (index_slots - 1)) * _INDEX_ENTRY.size
+            entry_key, offset, length, _ = _INDEX_ENTRY.unpack_from(mm, entry_pos)
+            if entry_key == key:
+                return entry_pos, offset, length
+            if entry_key == _EMPTY_KEY:
+                return entry_pos, -1, 0
+        return -1, -1, 0
+
+    def get(self, key: bytes) -> CompiledPage | None:
+        with self._lock:
+            if self._retired():
+                self._remap()
+            mm = self._mmap
+        _, offset, length = self._find(mm, key)
+        if offset < 0 or offset + length > len(mm):
+            return None
+        return CompiledPage.from_buffer(memoryview(mm)[offset : offset + length], key)
+
+    def put(self, key: bytes, page: CompiledPage):
+        data = page.to_bytes(key)
+        with self._lock:
+            for _ in range(3):
+                if self._retired():
+                    self._remap()
+                with self._locked_file():
+                    if self._retired():
+                        # Replaced by another process while waiting for the lock
+                        continue
+                    if self._write(key, data):
+                        return
+                    # Full, retry with a new file
+                    self._rotate()
+
+    def _write(self, key: bytes, data: bytes) -> bool:
+        mm = self._mmap
+        magic, version, retired, index_slots, data_size, data_used = _HEADER.unpack_from(mm)
+        entry_pos, offset, _ = self._find(mm, key)
+        if offset >= 0:
+            return True  # Already written by another process
+        if entry_pos < 0 or data_used + len(data) > data_size:
+            return False
+        offset = self._data_offset(index_slots) + data_used
+        mm[offset : offset + len(data)] = data
+        _HEADER.pack_into(mm, 0, magic, version, retired, index_slots, data_size, data_used + len(data))
+        # Readers verify the page data against the key, so a partially written entry is never used
+        _INDEX_ENTRY.pack_into(mm, entry_pos, key, offset, len(data), 0)
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = self._mmap = None
+
+    def make_key(
+        self,
+        params: FrozenErrorPageParams,
+        template: Template,
+        template_key: str,
+        slots: Iterable[str],
+        kwargs: Mapping[str, Any],
+    ) -> bytes:
+        # Templates are identified by their source, so that pages of a changed template are not reused
+        kwargs = {k: _template_digest(v) if isinstance(v, Template) else v for k, v in kwargs.items()}
+        data = json.dumps(
+            [
+                __version__,
+                template_key,
+                _template_digest(template),
+                params.allow_html,
+                params.to_dict(),
+                sorted(slots),
+                kwargs,
+            ],
+            sort_keys=True,
+            default=repr,
+        )
+        return hashlib.blake2b(data.encode(), digest_size=16).digest()
+
+    def render(
+        self,
+        params: ErrorPageParams | FrozenErrorPageParams,
+        allow_html: bool = True,
+        template: Template | None = None,
+        template_key: str | None = None,
+        slots: Mapping[str, Any] | None = None,
+        profiler: RenderProfiler | None = None,
+        **kwargs: Any,
+    ) -> bytes:
+        """Render a page like ``render``, reusing the pre-rendered page from the store if possible.
+
+        :param params: Parameters passed to the template. ``time`` and ``ray_id`` are generated per call if empty.
+        :param allow_html: Allow output raw HTML content from parameters.
+        :param template: Jinja template used to render the error page. Default template will be used if None.
+        :param template_key: Unique name of ``template`` shared by all processes. Defaults to the template name.
+            Pages are also keyed by the source of ``template`` and of templates passed in ``kwargs``, including
+            templates they extend or include by name, so they are rendered again when a template changes.
+        :param slots: Values that change per request. Keys may be ``time``, ``ray_id``, ``client_ip``, or keyword
+            arguments passed to the template. Slot values are HTML-escaped, so they must only be output as text.
+            The template must output them unchanged: slots must not be used in conditionals, filters or other
+            expressions (e.g. ``{{ value or 'default' }}``), which only see the placeholder. Slots which are None or
+            empty are rendered statically instead, so that such defaults still apply.
+        :param profiler: Passed to ``render`` when the page is not in the store yet.
+        :param kwargs: Additional keyword arguments passed to ``Template.render`` function. Must not change per request.
+        :return: The rendered error page as UTF-8 encoded bytes.
+        """
+        if not template:
+            template = base_template
+        template_key = template_key or template.name
+        if not template_key:
+            raise ValueError('template_key is required for templates without a name')
+
+        if not isinstance(params, FrozenErrorPageParams) or (not allow_html and params.allow_html):
+            params = FrozenErrorPageParams(params, allow_html=allow_html)
+        # Empty values are rendered as part of the page, the template may replace them with a default
+        slots = {name: value for name, value in (slots or {}).items() if value is not None and value != ''}
+        if not slots.get('time') and not params.get('time'):
+            slots['time'] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        if not slots.get('ray_id') and not params.get('ray_id'):
+            slots['ray_id'] = secrets.token_hex(8)
+        params = params.replace(**{name: None for name in _PARAM_SLOTS if name in slots})
+
+        key = self.make_key(params, template, template_key, slots, kwargs)
+        page = self.get(key)
+        if page is None:
+            placeholders = {name: _placeholder(name) for name in slots}
+            page = CompiledPage.from_rendered(
+                render(
+                    params.replace(**{k: v for k, v in placeholders.items() if k in _PARAM_SLOTS}),
+                    template=template,
+                    profiler=profiler,
+                    **{**kwargs, **{k: v for k, v in placeholders.items() if k not in _PARAM_SLOTS}},
+                )
+            )
+            self.put(key, page)
+        return page.fill(slots)
+
+
+__all__ = ['CompiledPage', 'PageStore']
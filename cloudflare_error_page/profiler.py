@@ -0,0 +1,191 @@
+"""Sampling profiler of template rendering.
+
+Sampled renders use an instrumented copy of the template, where every block, include and loop iteration is wrapped
+in a call to the profiler. Time and output size are recorded per call stack, and can be written in the collapsed
+stack format used by flame graph tools (e.g. ``flamegraph.pl``, speedscope).
+"""
+
+import os
+import random
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import IO, Any, Literal
+
+from jinja2 import Environment, Template, nodes
+from jinja2.visitor import NodeTransformer
+
+_PROFILE_FUNC = '_cferr_profile'
+
+
+def _section(label: str, body: list[nodes.Node], lineno: int, iteration: bool = False) -> nodes.CallBlock:
+    args: list[nodes.Expr] = [nodes.Const(label)]
+    if iteration:
+        args.append(nodes.Getattr(nodes.Name('loop', 'load'), 'index0', 'load'))
+    call = nodes.Call(nodes.Name(_PROFILE_FUNC, 'load'), args, [], None, None)
+    return nodes.CallBlock(call, [], [], body, lineno=lineno)
+
+
+def _target_name(target: nodes.Node) -> str:
+    if isinstance(target, nodes.Name):
+        return target.name
+    if isinstance(target, nodes.Tuple):
+        return ', '.join(_target_name(item) for item in target.items)
+    return '?'
+
+
+class _Instrumenter(NodeTransformer):
+    """Wraps blocks, includes and loop bodies with ``{% call _cferr_profile(...) %}``."""
+
+    def __init__(self, template_name: str | None):
+        self.template_name = template_name or '<template>'
+
+    def _label(self, what: str, node: nodes.Node) -> str:
+        return f'{what} ({self.template_name}:{node.lineno})'
+
+    def visit_Block(self, node: nodes.Block) -> nodes.Block:
+        self.generic_visit(node)
+        node.body = [_section(self._label(f'block {node.name}', node), node.body, node.lineno)]
+        return node
+
+    def visit_For(self, node: nodes.For) -> nodes.For:
+        self.generic_visit(node)
+        label = self._label(f'for {_target_name(node.target)}', node)
+        node.body = [_section(label, node.body, node.lineno, iteration=True)]
+        return node
+
+    def visit_Include(self, node: nodes.Include) -> nodes.CallBlock:
+        name = node.template.value if isinstance(node.template, nodes.Const) else '?'
+        return _section(self._label(f'include {name}', node), [node], node.lineno)
+
+
+class _ProfilingEnvironment(Environment):
+    def _parse(self, source: str, name: str | None, filename: str | None) -> nodes.Template:
+        return _Instrumenter(name).visit(super()._parse(source, name, filename))
+
+
+class RenderProfiler:
+    """Records render time and output size per template block, include and loop iteration.
+
+    Pass it to ``render`` to profile a fraction of the renders. Templates must be loaded from a loader (not
+    ``Environment.from_string``), so that their source can be compiled again with instrumentation.
+
+    :param sample_rate: Fraction of renders to profile, between 0 and 1.
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._environments: dict[int, tuple[Environment, Environment]] = {}
+        # call stack -> [total time (ns), total output size (bytes), count]
+        self._stacks: dict[tuple[str, ...], list[int]] = {}
+
+    def sample(self) -> bool:
+        """Decide whether to profile the next render."""
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    @staticmethod
+    def can_instrument(template: Template) -> bool:
+        """Whether ``template`` was loaded from a loader, which ``instrument`` requires."""
+        return template.name is not None and template.environment.loader is not None
+
+    def instrument(self, template: Template) -> Template:
+        """Return an instrumented copy of ``template``. Templates it includes or extends by name are instrumented."""
+        if not self.can_instrument(template):
+            raise ValueError('Only templates loaded from a loader can be profiled')
+        return self._environment(template.environment).get_template(template.name)
+
+    def _environment(self, environment: Environment) -> Environment:
+        with self._lock:
+            entry = self._environments.get(id(environment))
+            if entry is None or entry[0] is not environment:
+                profiling_env = environment.overlay()
+                profiling_env.__class__ = _ProfilingEnvironment
+                profiling_env.bytecode_cache = None
+                profiling_env.globals = {**environment.globals, _PROFILE_FUNC: self._profile_section}
+                entry = self._environments[id(environment)] = (environment, profiling_env)
+            return entry[1]
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[list[str]]:
+        """Record a render as root frame ``name``. Append the output to the yielded list to record its size."""
+        stack = getattr(self._local, 'stack', None)
+        self._local.stack = [name] if stack is None else stack + [name]
+        output: list[str] = []
+        start = time.perf_counter_ns()
+        try:
+            yield output
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            self._add(tuple(self._local.stack), elapsed, sum(len(s.encode()) for s in output))
+            self._local.stack = stack
+
+    def _profile_section(self, label: str, index: int | None = None, *, caller) -> Any:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            # Instrumented template rendered outside of profile()
+            return caller()
+        if index is not None:
+            label = f'{label} [{index}]'
+        stack.append(label.replace(';', ','))
+        start = time.perf_counter_ns()
+        try:
+            output = caller()
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            key = tuple(stack)
+            stack.pop()
+        self._add(key, elapsed, len(str(output).encode()))
+        return output
+
+    def _add(self, key: tuple[str, ...], elapsed: int, size: int):
+        with self._lock:
+            entry = self._stacks.get(key)
+            if entry is None:
+                self._stacks[key] = [elapsed, size, 1]
+            else:
+                entry[0] += elapsed
+                entry[1] += size
+                entry[2] += 1
+
+    def stats(self) -> dict[tuple[str, ...], tuple[int, int, int]]:
+        """Return total time (ns), total output size (bytes) and count per call stack. Totals include children."""
+        with self._lock:
+            return {key: (entry[0], entry[1], entry[2]) for key, entry in self._stacks.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+
+    def collapsed(self, metric: Literal['time', 'bytes'] = 'time') -> list[str]:
+        """Return the profile in collapsed stack format, one ``frame;frame;... value`` line per stack.
+
+        Values exclude children, as expected by flame graph tools. Time is in microseconds.
+        """
+        index = 0 if metric == 'time' else 1
+        stats = self.stats()
+        exclusive = {key: entry[index] for key, entry in stats.items()}
+        for key, entry in stats.items():
+            parent = key[:-1]
+            if parent in exclusive:
+                exclusive[parent] -= entry[index]
+        lines = []
+        for key, value in sorted(exclusive.items()):
+            if metric == 'time':
+                value //= 1000
+            lines.append(f'{";".join(key)} {max(value, 0)}')
+        return lines
+
+    def dump(self, file: str | os.PathLike | IO[str], metric: Literal['time', 'bytes'] = 'time'):
+        """Write the profile in collapsed stack format to a path or text file."""
+        data = ''.join(f'{line}\n' for line in self.collapsed(metric))
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, 'w') as f:
+                f.write(data)
+        else:
+            file.write(data)
+
+
+__all__ = ['RenderProfiler']
@@ -1,5 +1,6 @@
 # SPDX-License-Identifier: MIT
 
+import atexit
 import os
 from pathlib import Path
 import secrets
@@ -61,6 +62,35 @@ def _initialize_app_config(app: Flask):
         static_dir = os.path.join(app.instance_path, app.config.get('STATIC_DIR', '../../web/dist'))
     app.logger.info(f'Static directory: {static_dir}')
 
+    # Stored per app, so that apps created with different configs don't share them
+    page_store = None
+    page_store_path = app.config.get('PAGE_STORE_PATH', '')
+    if page_store_path:
+        from cloudflare_error_page.page_store import PageStore
+
+        page_store_path = os.path.join(app.instance_path, page_store_path)
+        page_store = PageStore(page_store_path, size=app.config.get('PAGE_STORE_SIZE', 64 * 1024 * 1024))
+        app.logger.info(f'Page store: {page_store_path}')
+    app.extensions['cf_error_page_store'] = page_store
+
+    profiler = None
+    profile_sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0)
+    if profile_sample_rate > 0:
+        from cloudflare_error_page import RenderProfiler
+
+        profiler = RenderProfiler(sample_rate=profile_sample_rate)
+        profile_output = os.path.join(app.instance_path, app.config.get('PROFILE_OUTPUT', 'render-{metric}-{pid}.folded'))
+        atexit.register(_dump_profile, profiler, profile_output)
+        app.logger.info(f'Render profiling enabled, sample rate: {profile_sample_rate}')
+    app.extensions['cf_error_page_profiler'] = profiler
+
+
+def _dump_profile(profiler, output: str):
+    for metric in ('time', 'bytes'):
+        path = output.replace('{metric}', metric).replace('{pid}', str(os.getpid()))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profiler.dump(path, metric=metric)
+
 
 def create_app(test_config=None) -> Flask:
     instance_path = os.getenv('INSTANCE_PATH')
@@ -78,9 +108,11 @@ def create_app(test_config=None) -> Flask:
     from . import examples
     from . import editor
     from . import share
+    from .view_stats import ViewStats
 
     db.init_app(app)
     limiter.init_app(app)
+    ViewStats(app)
 
     with app.app_context():
         db.create_all()
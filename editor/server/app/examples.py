@@ -1,6 +1,5 @@
 # SPDX-License-Identifier: MIT
 
-import copy
 import os
 from pathlib import Path
 import re
@@ -12,7 +11,7 @@ from flask import (
     redirect,
 )
 
-from cloudflare_error_page import ErrorPageParams
+from cloudflare_error_page import FrozenErrorPageParams
 from .utils import (
     render_extended_template,
 )
@@ -20,23 +19,23 @@ from .utils import (
 
 bp = Blueprint('examples', __name__, url_prefix='/')
 examples_dir = Path(__file__).parent / 'data' / 'examples'
-param_cache: dict[str, dict] = {}
+param_cache: dict[str, FrozenErrorPageParams] = {}
 
 if not os.path.exists(examples_dir):
     print('"example" directory does not exist. Run "hatch build" to generate.')
     exit(1)
 
 
-def get_page_params(name: str) -> ErrorPageParams:
+def get_page_params(name: str) -> FrozenErrorPageParams | None:
     name = re.sub(r'[^\w]', '', name)
     params = param_cache.get(name)
     if params is not None:
-        return copy.deepcopy(params)
+        return params
     try:
         with open(os.path.join(examples_dir, f'{name}.json')) as f:
-            params = json.load(f)
+            params = FrozenErrorPageParams(json.load(f))
         param_cache[name] = params
-        return copy.deepcopy(params)
+        return params
     except Exception as _:
         return None
 
@@ -17,3 +17,9 @@ class Item(db.Model):
     name = Column(String(255), unique=True, nullable=False, index=True)
     params = Column(JSON, nullable=False)
     time_created = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ItemViews(db.Model):
+    name = Column(String(255), primary_key=True, nullable=False)
+    views = Column(Integer, nullable=False, default=0)
+    time_last_viewed = Column(DateTime(timezone=True))
@@ -1,11 +1,12 @@
 # SPDX-License-Identifier: MIT
 
+from datetime import timezone
 import random
 import string
 from typing import cast
 
 
-from cloudflare_error_page import ErrorPageParams
+from cloudflare_error_page import ErrorPageParams, FrozenErrorPageParams
 from flask import (
     Blueprint,
     current_app,
@@ -22,8 +23,9 @@ from . import (
 )
 from .utils import (
     render_extended_template,
-    sanitize_page_param_links,
+    sanitize_user_link,
 )
+from .view_stats import get_view_stats
 
 bp = Blueprint('share', __name__, url_prefix='/')
 bp_short = Blueprint('share_short', __name__, url_prefix='/')
@@ -53,6 +55,13 @@ def create():
     # Accessing request.json raises 415 error if Content-Type is not application/json. This also prevents CSRF requests.
     # See https://developer.mozilla.org/en-US/docs/Web/Security/Attacks/CSRF#avoiding_simple_requests
     params = request.json['parameters']  # throws KeyError
+    try:
+        FrozenErrorPageParams(params)
+    except (TypeError, ValueError) as e:
+        return {
+            'status': 'failed',
+            'message': str(e),
+        }, 400
 
     # TODO: strip unused params
     try:
@@ -97,13 +106,37 @@ def get(name: str):
             'parameters': params,
         }
     else:
+        get_view_stats().record(name)
         params['creator_info'] = {
             'hidden': False,
             'text': 'CF Error Page Editor',
             'link': request.host_url[:-1] + url_for('editor.index') + f'#from={name}',
         }
-        sanitize_page_param_links(params)
-        return render_extended_template(params=params, allow_html=False)
+        # Not strict, items created before parameters were validated may contain invalid values
+        params = FrozenErrorPageParams(params, allow_html=False, link_sanitizer=sanitize_user_link, strict=False)
+        return render_extended_template(params=params)
+
+
+@bp.get('/<name>/views')
+def views(name: str):
+    item = db.session.query(models.Item).filter_by(name=name).first()
+    if not item:
+        return {'status': 'notfound'}
+    item_views = db.session.get(models.ItemViews, name)
+    views = item_views.views if item_views else 0
+    last_viewed = item_views.time_last_viewed if item_views else None
+    # Include views not flushed to the database yet (of this process only)
+    pending_views, pending_last_viewed = get_view_stats().pending(name)
+    views += pending_views
+    last_viewed = pending_last_viewed or last_viewed
+    if last_viewed and last_viewed.tzinfo is None:
+        last_viewed = last_viewed.replace(tzinfo=timezone.utc)  # SQLite doesn't store timezones
+    return {
+        'status': 'ok',
+        'name': name,
+        'views': views,
+        'last_viewed': last_viewed.isoformat() if last_viewed else None,
+    }
 
 
 @bp.get('/<name>')
@@ -1,23 +1,21 @@
+import html
 import json
 import os
 import re
+from functools import lru_cache
 from typing import Any
 from pathlib import Path
 
 from cloudflare_error_page import (
     ErrorPageParams,
+    FrozenErrorPageParams,
     base_template as base_template,
     render as render_cf_error_page,
 )
 from flask import current_app, request
-from jinja2 import Environment, select_autoescape
+from jinja2 import DictLoader, Environment, select_autoescape
 
-env = Environment(
-    autoescape=select_autoescape(),
-    trim_blocks=True,
-    lstrip_blocks=True,
-)
-template = env.from_string("""{% extends base %}
+template_source = """{% extends base %}
 
 {% block html_head %}
 {% if page_icon_url %}
@@ -45,7 +43,15 @@ template = env.from_string("""{% extends base %}
 <meta property="twitter:image" content="{{ page_image_url }}" />
 {% endif %}
 {% endblock %}
-""")
+"""
+# Loaded by name (instead of from_string) so that the template can be profiled
+env = Environment(
+    loader=DictLoader({'editor.html': template_source}),
+    autoescape=select_autoescape(),
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+template = env.get_template('editor.html')
 
 
 loc_data: dict = None
@@ -75,24 +81,24 @@ def get_cf_location(loc: str):
     return data.get('city')
 
 
-def fill_cf_template_params(params: ErrorPageParams):
+def fill_cf_template_params(params: FrozenErrorPageParams) -> FrozenErrorPageParams:
+    changes = {}
     # Get the real Ray ID / data center location from Cloudflare header
     ray_id_loc = request.headers.get('Cf-Ray')
     if ray_id_loc:
-        params['ray_id'] = ray_id_loc[:16]
+        changes['ray_id'] = ray_id_loc[:16]
 
-        cf_status = params.get('cloudflare_status')
-        if cf_status is None:
-            cf_status = params['cloudflare_status'] = {}
+        cf_status = params.get('cloudflare_status') or {}
         if not cf_status.get('location'):
             loc = get_cf_location(ray_id_loc[-3:])
             if loc:
-                cf_status['location'] = loc
+                changes['cloudflare_status'] = {**cf_status, 'location': loc}
 
     # Get the real client ip from remote_addr
     # If this server is behind proxies (e.g CF CDN / Nginx), make sure to set 'BEHIND_PROXY'=True in app config. Then ProxyFix will fix this variable
     # using X-Forwarded-For header from the proxy.
-    params['client_ip'] = request.remote_addr
+    changes['client_ip'] = request.remote_addr
+    return params.replace(**changes)
 
 
 def sanitize_user_link(link: str):
@@ -105,23 +111,19 @@ def sanitize_user_link(link: str):
     return '#' + link
 
 
-def sanitize_page_param_links(param: ErrorPageParams):
-    more_info = param.get('more_information')
-    if more_info:
-        link = more_info.get('link')
-        if link:
-            more_info['link'] = sanitize_user_link(link)
-    perf_sec_by = param.get('perf_sec_by')
-    if perf_sec_by:
-        link = perf_sec_by.get('link')
-        if link:
-            perf_sec_by['link'] = sanitize_user_link(link)
+@lru_cache(maxsize=1024)
+def get_page_description(what_happened: str | None, escaped: bool) -> str:
+    description = what_happened or "There is an internal server error on Cloudflare's network."
+    if escaped:
+        description = html.unescape(description)
+    return re.sub(r'<\/?.*?>', '', description).strip()
 
 
-def render_extended_template(params: ErrorPageParams, *args: Any, **kwargs: Any) -> str:
-    fill_cf_template_params(params)
-    description = params.get('what_happened') or "There is an internal server error on Cloudflare's network."
-    description = re.sub(r'<\/?.*?>', '', description).strip()
+def render_extended_template(params: ErrorPageParams | FrozenErrorPageParams, **kwargs: Any) -> str | bytes:
+    if not isinstance(params, FrozenErrorPageParams):
+        params = FrozenErrorPageParams(params)
+    params = fill_cf_template_params(params)
+    description = get_page_description(params.get('what_happened'), not params.allow_html)
 
     status = 'ok'
     cf_status_obj = params.get('cloudflare_status')
@@ -132,6 +134,25 @@ def render_extended_template(params: ErrorPageParams, *args: Any, **kwargs: Any)
     page_icon_url = current_app.config.get('PAGE_ICON_URL', '').replace('{status}', status)
     page_icon_type = current_app.config.get('PAGE_ICON_TYPE')
     page_image_url = current_app.config.get('PAGE_IMAGE_URL', '').replace('{status}', status)
+    page_store = current_app.extensions.get('cf_error_page_store')
+    profiler = current_app.extensions.get('cf_error_page_profiler')
+    if page_store is not None:
+        return page_store.render(
+            params=params,
+            template=template,
+            slots={
+                'ray_id': params.get('ray_id'),
+                'client_ip': params.get('client_ip'),
+                'page_url': request.url,
+            },
+            base=base_template,
+            page_icon_url=page_icon_url,
+            page_icon_type=page_icon_type,
+            page_description=description,
+            page_image_url=page_image_url,
+            profiler=profiler,
+            **kwargs,
+        )
     return render_cf_error_page(
         params=params,
         template=template,
@@ -141,6 +162,6 @@ def render_extended_template(params: ErrorPageParams, *args: Any, **kwargs: Any)
         page_url=request.url,
         page_description=description,
         page_image_url=page_image_url,
-        *args,
+        profiler=profiler,
         **kwargs,
     )
@@ -0,0 +1,120 @@
+# SPDX-License-Identifier: MIT
+
+import atexit
+import os
+import threading
+from datetime import datetime, timezone
+
+from flask import Flask, current_app
+from sqlalchemy import select
+
+from . import db, models
+
+
+class ViewStats:
+    """Buffer of share page views, written to the database in batches.
+
+    Views are aggregated per share name in memory and flushed periodically by a background thread in a single
+    transaction, so that viewing a page doesn't need a database write. The number of pending names is bounded by
+    ``VIEW_STATS_MAX_PENDING``; views of new names are dropped when the buffer is full. Pending views are flushed on
+    interpreter exit, but may be lost if the process crashes.
+
+    One instance is stored per app in ``app.extensions``, use ``get_view_stats`` to get the one of the current app.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.flush_interval = float(app.config.get('VIEW_STATS_FLUSH_INTERVAL', 10))
+        self.max_pending = int(app.config.get('VIEW_STATS_MAX_PENDING', 10000))
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pending: dict[str, tuple[int, datetime]] = {}
+        self._wakeup = threading.Event()
+        self._thread_pid: int | None = None
+        app.extensions['cf_error_page_view_stats'] = self
+        atexit.register(self.flush)
+
+    def record(self, name: str):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            entry = self._pending.get(name)
+            if entry is not None:
+                self._pending[name] = (entry[0] + 1, now)
+            elif len(self._pending) < self.max_pending:
+                self._pending[name] = (1, now)
+            else:
+                self.dropped += 1
+                self._wakeup.set()
+            # Threads don't survive fork(), e.g. gunicorn workers with preloading, so start one per process
+            if self._thread_pid != os.getpid():
+                self._thread_pid = os.getpid()
+                threading.Thread(target=self._run, name='view-stats-flush', daemon=True).start()
+
+    def pending(self, name: str) -> tuple[int, datetime | None]:
+        with self._lock:
+            return self._pending.get(name, (0, None))
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with self.app.app_context():
+            try:
+                self._write(pending)
+                db.session.commit()
+            except:
+                db.session.rollback()
+                self.app.logger.exception('Failed to flush share view stats')
+                self._restore(pending)
+
+    def _write(self, pending: dict[str, tuple[int, datetime]]):
+        table = models.ItemViews.__table__
+        rows = [{'name': name, 'views': count, 'time_last_viewed': time} for name, (count, time) in pending.items()]
+        dialect = db.engine.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            # Keep the number of bound parameters per statement below SQLite's limit
+            for i in range(0, len(rows), 250):
+                stmt = insert(table).values(rows[i : i + 250])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[table.c.name],
+                    set_={
+                        'views': table.c.views + stmt.excluded.views,
+                        'time_last_viewed': stmt.excluded.time_last_viewed,
+                    },
+                )
+                db.session.execute(stmt)
+            return
+        pending = {**pending}
+        existing = db.session.scalars(select(models.ItemViews).where(models.ItemViews.name.in_(pending.keys())))
+        for item in existing:
+            count, time = pending.pop(item.name)
+            item.views += count
+            item.time_last_viewed = time
+        for name, (count, time) in pending.items():
+            db.session.add(models.ItemViews(name=name, views=count, time_last_viewed=time))
+
+    def _restore(self, pending: dict[str, tuple[int, datetime]]):
+        with self._lock:
+            for name, (count, time) in pending.items():
+                entry = self._pending.get(name)
+                if entry is not None:
+                    self._pending[name] = (entry[0] + count, entry[1])
+                elif len(self._pending) < self.max_pending:
+                    self._pending[name] = (count, time)
+                else:
+                    self.dropped += count
+
+
+def get_view_stats() -> ViewStats:
+    return current_app.extensions['cf_error_page_view_stats']
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""Offline load test for the editor server.
+
+Starts the app returned by ``create_app()`` on a local threaded WSGI server, using a temporary instance directory
+(SQLite database and config) and a stub static directory, then drives mixed traffic against it from a number of
+concurrent clients. A JSON report with throughput, latency percentiles, error rates and SQLite lock contention is
+printed or written to a file, so that runs can be compared.
+
+Example:
+    python loadtest.py --concurrency 16 --duration 30 --mix share_get_html=5,share_create=1 -o report.json
+"""
+
+import argparse
+import contextlib
+import glob
+import http.client
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+server_dir = Path(__file__).parent
+root_dir = server_dir.parent.parent
+
+DEFAULT_MIX = {
+    'share_create': 1,
+    'share_get_html': 4,
+    'share_get_json': 2,
+    'share_views': 1,
+    'examples': 4,
+    'static': 2,
+    'health': 1,
+}
+
+SAMPLE_PARAMS = {
+    'title': 'Internal server error',
+    'error_code': '500',
+    'more_information': {'text': 'example.com', 'link': 'example.com'},
+    'cloudflare_status': {'status': 'error', 'status_text': 'Error'},
+    'host_status': {'status': 'ok', 'location': 'example.com'},
+    'error_source': 'cloudflare',
+    'what_happened': '<p>There is an internal server error on Cloudflare\'s network.</p>',
+    'what_can_i_do': '<p>Please try again in a few minutes.</p>',
+}
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'unknown request type "{name}", valid: {", ".join(DEFAULT_MIX)}')
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'invalid weight for "{name}": {weight}')
+    if not mix or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError('request mix must have a positive total weight')
+    return mix
+
+
+def percentile(sorted_values: list[float], p: float) -> float | None:
+    if not sorted_values:
+        return None
+    # Nearest-rank method
+    index = min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize_latencies(latencies: list[float]) -> dict[str, float | None]:
+    values = sorted(latencies)
+    ms = lambda v: None if v is None else round(v * 1000, 3)  # noqa: E731
+    return {
+        'mean_ms': ms(sum(values) / len(values)) if values else None,
+        'p50_ms': ms(percentile(values, 50)),
+        'p90_ms': ms(percentile(values, 90)),
+        'p99_ms': ms(percentile(values, 99)),
+        'max_ms': ms(values[-1]) if values else None,
+    }
+
+
+class Stats:
+    """Request results collected from all client threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: Counter[str] = Counter()
+        self.status_codes: dict[str, Counter[int]] = {}
+
+    def record(self, name: str, latency: float, status: int | None, ok: bool):
+        with self.lock:
+            self.latencies.setdefault(name, []).append(latency)
+            self.status_codes.setdefault(name, Counter())[status or 0] += 1
+            if not ok:
+                self.errors[name] += 1
+
+
+class DbStats:
+    """SQLite statement timings and lock errors, collected through SQLAlchemy engine events."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements = 0
+        self.write_times: list[float] = []
+        self.lock_errors = 0
+        self.other_errors = 0
+
+    def attach(self, engine):
+        from sqlalchemy import event
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('loadtest_start', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info['loadtest_start'].pop()
+            with self.lock:
+                self.statements += 1
+                if not statement.lstrip().upper().startswith('SELECT'):
+                    self.write_times.append(elapsed)
+
+        @event.listens_for(engine, 'handle_error')
+        def handle_error(context):
+            starts = context.connection.info.get('loadtest_start') if context.connection is not None else None
+            if starts:
+                starts.pop()
+            with self.lock:
+                if 'locked' in str(context.original_exception).lower():
+                    self.lock_errors += 1
+                else:
+                    self.other_errors += 1
+
+    def report(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                'statements': self.statements,
+                'writes': len(self.write_times),
+                'write_latency': summarize_latencies(self.write_times),
+                'lock_errors': self.lock_errors,
+                'other_errors': self.other_errors,
+            }
+
+
+def prepare_environment(work_dir: str, rate_limit: bool, page_store: bool) -> None:
+    instance_dir = os.path.join(work_dir, 'instance')
+    static_dir = os.path.join(work_dir, 'static')
+    os.makedirs(instance_dir)
+    os.makedirs(os.path.join(static_dir, 'assets'))
+    with open(os.path.join(static_dir, 'index.html'), 'w') as f:
+        f.write('<!DOCTYPE html><html><body>Editor</body></html>\n')
+    with open(os.path.join(static_dir, 'assets', 'index.js'), 'w') as f:
+        f.write('console.log("editor");\n' * 256)
+    database = Path(instance_dir, 'database.db').as_posix()
+    with open(os.path.join(instance_dir, 'config.toml'), 'w') as f:
+        f.write(f"SQLALCHEMY_DATABASE_URI = 'sqlite:///{database}'\n")
+        f.write('BEHIND_PROXY = false\n')
+        f.write(f'RATELIMIT_ENABLED = {"true" if rate_limit else "false"}\n')
+        if page_store:
+            f.write("PAGE_STORE_PATH = 'pages.bin'\n")
+    os.environ['INSTANCE_PATH'] = instance_dir
+    os.environ['STATIC_DIR'] = static_dir
+
+    # Same as hatch_build.py, the examples are copied into the package when it's built
+    examples_dir = server_dir / 'app' / 'data' / 'examples'
+    if not examples_dir.exists():
+        os.makedirs(examples_dir)
+        for file in glob.glob(str(root_dir / 'examples' / '*.json')):
+            shutil.copy(file, examples_dir)
+
+
+def request(
+    conn: http.client.HTTPConnection,
+    method: str,
+    path: str,
+    body: bytes | None = None,
+    headers: dict[str, str] | None = None,
+) -> tuple[int, bytes]:
+    conn.request(method, path, body=body, headers=headers or {})
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+class Client:
+    """A single client connection, sending one request of the given type at a time."""
+
+    def __init__(self, host: str, port: int, share_names: list[str], names_lock: threading.Lock, rng: random.Random):
+        self.host = host
+        self.port = port
+        self.conn = http.client.HTTPConnection(host, port, timeout=30)
+        self.share_names = share_names
+        self.names_lock = names_lock
+        self.rng = rng
+        self.handlers: dict[str, Callable[[], bool]] = {
+            'share_create': self.share_create,
+            'share_get_html': lambda: self.share_get(json_accept=False),
+            'share_get_json': lambda: self.share_get(json_accept=True),
+            'share_views': self.share_views,
+            'examples': self.examples,
+            'static': self.static,
+            'health': self.health,
+        }
+        self.last_status: int | None = None
+
+    def _request(self, *args: Any, **kwargs: Any) -> tuple[int, bytes]:
+        try:
+            status, body = request(self.conn, *args, **kwargs)
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            raise
+        self.last_status = status
+        return status, body
+
+    def share_create(self) -> bool:
+        params = {**SAMPLE_PARAMS, 'title': f'Load test {self.rng.randrange(1 << 30)}'}
+        status, body = self._request(
+            'POST',
+            '/s/create',
+            body=json.dumps({'parameters': params}).encode(),
+            headers={'Content-Type': 'application/json'},
+        )
+        if status != 200:
+            return False
+        result = json.loads(body)
+        if result.get('status') != 'ok':
+            return False
+        with self.names_lock:
+            self.share_names.append(result['name'])
+        return True
+
+    def share_get(self, json_accept: bool) -> bool:
+        with self.names_lock:
+            name = self.rng.choice(self.share_names)
+        headers = {'Accept': 'application/json'} if json_accept else {'Accept': 'text/html'}
+        status, body = self._request('GET', f'/s/{name}', headers=headers)
+        if json_accept:
+            return status == 200 and json.loads(body).get('status') == 'ok'
+        return status == 200
+
+    def share_views(self) -> bool:
+        with self.names_lock:
+            name = self.rng.choice(self.share_names)
+        status, body = self._request('GET', f'/s/{name}/views')
+        return status == 200 and json.loads(body).get('status') == 'ok'
+
+    def examples(self) -> bool:
+        name = self.rng.choice(['default', 'catastrophic', 'working'])
+        status, _ = self._request('GET', f'/examples/{name}')
+        return status == 200
+
+    def static(self) -> bool:
+        path = self.rng.choice(['/editor/', '/editor/assets/index.js'])
+        status, _ = self._request('GET', path)
+        return status == 200
+
+    def health(self) -> bool:
+        status, _ = self._request('GET', '/health')
+        return status == 204
+
+
+def run_load(
+    host: str,
+    port: int,
+    mix: dict[str, float],
+    concurrency: int,
+    duration: float | None,
+    total_requests: int | None,
+    share_names: list[str],
+    seed: int,
+) -> tuple[Stats, float]:
+    stats = Stats()
+    names_lock = threading.Lock()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    counter_lock = threading.Lock()
+    remaining = [total_requests]
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+
+    def take() -> bool:
+        if deadline is not None and time.perf_counter() >= deadline:
+            return False
+        if remaining[0] is None:
+            return True
+        with counter_lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def worker(index: int):
+        rng = random.Random(seed + index)
+        client = Client(host, port, share_names, names_lock, rng)
+        while take():
+            name = rng.choices(names, weights)[0]
+            client.last_status = None
+            t0 = time.perf_counter()
+            try:
+                ok = client.handlers[name]()
+            except Exception:
+                ok = False
+            stats.record(name, time.perf_counter() - t0, client.last_status, ok)
+        client.conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats, time.perf_counter() - start
+
+
+def build_report(args: argparse.Namespace, stats: Stats, db_stats: DbStats, elapsed: float) -> dict[str, Any]:
+    endpoints = {}
+    all_latencies = []
+    total_errors = 0
+    for name, latencies in sorted(stats.latencies.items()):
+        errors = stats.errors[name]
+        total_errors += errors
+        all_latencies.extend(latencies)
+        endpoints[name] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'error_rate': round(errors / len(latencies), 6),
+            'throughput_rps': round(len(latencies) / elapsed, 3),
+            'status_codes': {str(k): v for k, v in sorted(stats.status_codes[name].items())},
+            'latency': summarize_latencies(latencies),
+        }
+    total = len(all_latencies)
+    return {
+        'config': {
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'requests': args.requests,
+            'mix': args.mix,
+            'seed_shares': args.seed_shares,
+            'rate_limit': args.rate_limit,
+            'page_store': args.page_store,
+            'seed': args.seed,
+            'python': sys.version.split()[0],
+        },
+        'elapsed_s': round(elapsed, 3),
+        'requests': total,
+        'errors': total_errors,
+        'error_rate': round(total_errors / total, 6) if total else None,
+        'throughput_rps': round(total / elapsed, 3) if elapsed else None,
+        'latency': summarize_latencies(all_latencies),
+        'endpoints': endpoints,
+        'database': db_stats.report(),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Offline load test for the editor server.')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='number of concurrent clients (default: 8)')
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help='test duration in seconds (default: 10)')
+    parser.add_argument('-n', '--requests', type=int, help='stop after this many requests instead of a duration')
+    parser.add_argument(
+        '--mix',
+        type=parse_mix,
+        default=DEFAULT_MIX,
+        help='weighted request mix, e.g. "share_get_html=4,share_create=1". Types: ' + ', '.join(DEFAULT_MIX),
+    )
+    parser.add_argument('--seed-shares', type=int, default=50, help='shares created before the test (default: 50)')
+    parser.add_argument('--rate-limit', action='store_true', help='keep the Flask-Limiter rate limits enabled')
+    parser.add_argument('--page-store', action='store_true', help='serve pages from the shared page store')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('-o', '--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args(argv)
+    if args.requests is not None:
+        args.duration = None
+
+    with tempfile.TemporaryDirectory(prefix='cferr-loadtest-') as work_dir:
+        prepare_environment(work_dir, args.rate_limit, args.page_store)
+
+        sys.path.insert(0, str(server_dir))
+        from werkzeug.serving import make_server
+        from app import create_app, db
+        from app.view_stats import get_view_stats
+
+        # Keep stdout clean for the report
+        with contextlib.redirect_stdout(sys.stderr):
+            app = create_app()
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        host, port = server.server_address[:2]
+        try:
+            share_names: list[str] = []
+            seeder = Client(host, port, share_names, threading.Lock(), random.Random(args.seed))
+            for _ in range(max(1, args.seed_shares)):
+                if not seeder.share_create():
+                    print('Failed to create seed shares, is the rate limit enabled?', file=sys.stderr)
+                    return 1
+            seeder.conn.close()
+
+            db_stats = DbStats()
+            with app.app_context():
+                db_stats.attach(db.engine)
+            stats, elapsed = run_load(
+                host,
+                port,
+                args.mix,
+                args.concurrency,
+                args.duration,
+                args.requests,
+                share_names,
+                args.seed,
+            )
+        finally:
+            server.shutdown()
+            with app.app_context():
+                get_view_stats().flush()
+                db.engine.dispose()
+
+    report = build_report(args, stats, db_stats, elapsed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())